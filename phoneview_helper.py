@@ -16,11 +16,10 @@ __all__ = [
 
 
 # Standard Python library
-import collections
 import csv
 import datetime
 import enum
-import io
+import functools
 import re
 import textwrap
 import typing
@@ -39,17 +38,38 @@ except ImportError as err:
             {original_msg}
         """.format(original_msg=err.message))
 
+# NumPy library: Installed as a dependency of pandas
+import numpy as np
+
 
 # Some hard-coded constants
 
 DEFAULT_PHONE_REGION = "US"
 
+# Characters stripped from phone numbers when `phonenumbers` is unavailable
+_PHONE_STRIP_TABLE = str.maketrans("", "", " ()-+")
+
 # Some hard-coded constants having to do with the PhoneView file format
 
 PHONEVIEW_INTERNAL_DB_FIELDS = ["id", "date", "address", "text", "flags"]
+_PHONEVIEW_INTERNAL_DB_FIELDS_SET = frozenset(PHONEVIEW_INTERNAL_DB_FIELDS)
 PHONEVIEW_INTERNAL_RECEIVED = "2"
 PHONEVIEW_INTERNAL_SENT = "3"
 PHONEVIEW_EXTERNAL_RECEIVED = "Received"
+PHONEVIEW_EXTERNAL_FIELDS = [
+    "direction", "timestamp", "name", "number", "content", "type"]
+PHONEVIEW_EXTERNAL_TIMESTAMP_FORMAT = "%b %d, %Y %H:%M:%S %p"
+
+# Number of rows read at a time when loading a CSV file
+
+CSV_BATCH_SIZE = 50000
+
+# Regular expressions used to shorten the date labels of plots, compiled once
+
+DEFAULT_LABEL_REGEXP = r"([0-9]*)/[0-9]*"
+
+_DEFAULT_LABEL_RE = re.compile(DEFAULT_LABEL_REGEXP)
+_LABEL_RE_CACHE = {}
 
 # The elementary record type for an entry of PhoneView message log
 
@@ -73,75 +93,136 @@ class PlotStyle(enum.Enum):
     VOLUME = 'volume'
 
 
+def _parse_timestamp(timestamp_str: str) -> datetime.datetime:
+    # Unix timestamps, as in the internal format (checked first, because
+    # `fromisoformat` would also accept some all-digit strings)
+    try:
+        return datetime.datetime.fromtimestamp(int(timestamp_str))
+    except ValueError:
+        pass
+
+    # ISO 8601 timestamps are the cheapest to parse
+    try:
+        timestamp = datetime.datetime.fromisoformat(
+            timestamp_str.replace("Z", "+00:00"))
+    except ValueError:
+        pass
+    else:
+        # like everywhere else, keep timestamps as naive local times
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone().replace(tzinfo=None)
+        return timestamp
+
+    # anything else must be in the format of the external files
+    return datetime.datetime.strptime(
+        timestamp_str, PHONEVIEW_EXTERNAL_TIMESTAMP_FORMAT)
+
+
+def _parse_timestamp_column(timestamp_strs: pd.Series) -> pd.Series:
+    # run the interpreted parser once per distinct string, and let pandas
+    # map the results back onto every row
+    parsed = {
+        timestamp_str: _parse_timestamp(timestamp_str)
+        for timestamp_str in timestamp_strs.unique()
+    }
+    return pd.to_datetime(timestamp_strs.map(parsed))
+
+
+def _is_internal_phoneview_header(row: typing.List[str]) -> bool:
+    # stop as soon as two internal field names have been found
+    matches = 0
+    for field in row:
+        if field in _PHONEVIEW_INTERNAL_DB_FIELDS_SET:
+            matches += 1
+            if matches > 1:
+                return True
+
+    return False
+
+
 def _load_internal_phoneview_msg_file(
-        raw_rows: typing.List[typing.List[str]],
-        header: typing.List[str]
-) -> typing.List[PhoneViewMsgData]:
+        raw_df: pd.DataFrame,
+        keep_number: bool = True,
+        keep_name: bool = True
+) -> pd.DataFrame:
 
-    records = []
-    
-    for row in raw_rows:
-        row_dict = dict(zip(header, row))
-        
-        record = collections.OrderedDict()
-        
-        if "date" in row_dict:
-            # the timestamp is in Unix format
-            timestamp = int(row_dict["date"])
-            record["timestamp"] = datetime.datetime.fromtimestamp(timestamp)
-        
-        if "flags" in row_dict:
-            record["inbound"] = (row_dict["flags"] == PHONEVIEW_INTERNAL_RECEIVED)
-        
-        text = row_dict.get("text", "")
-        record["length"] = len(text)
-        record["content"] = text
-        
-        if "address" in row_dict:
-            record["number"] = row_dict["address"]
-        
-        if "grouptitle" in row_dict and row_dict.get("grouptitle") != "":
-            record["name"] = row_dict["grouptitle"]
-        
-        records.append(record)
-    
-    return records
+    # gather the columns first, and build the dataframe in one go, rather
+    # than inserting the columns into an existing dataframe one by one
+    columns = {}
+
+    if "date" in raw_df:
+        # the timestamp is in Unix format, convert it to naive local time
+        # with `datetime.fromtimestamp`, once per distinct value (pandas has
+        # no vectorized path for the local timezone, and would otherwise
+        # look up daylight saving time for every row)
+        columns["timestamp"] = _parse_timestamp_column(raw_df["date"])
+
+    if "flags" in raw_df:
+        columns["inbound"] = raw_df["flags"].eq(PHONEVIEW_INTERNAL_RECEIVED)
+
+    if "text" in raw_df:
+        text = raw_df["text"]
+    else:
+        text = pd.Series("", index=raw_df.index, dtype=object)
+    columns["length"] = text.str.len()
+    columns["content"] = text
+
+    if keep_number and "address" in raw_df:
+        columns["number"] = raw_df["address"]
+
+    if keep_name and "grouptitle" in raw_df:
+        # only group conversations have a name
+        name = raw_df["grouptitle"].where(raw_df["grouptitle"] != "")
+        if name.notna().any():
+            columns["name"] = name
+
+    return pd.DataFrame(columns, index=raw_df.index)
 
 
 def _load_external_phoneview_msg_file(
-        raw_rows: typing.List[typing.List[str]]
-) -> typing.List[PhoneViewMsgData]:
+        raw_df: pd.DataFrame,
+        keep_number: bool = True,
+        keep_name: bool = True,
+        keep_type: bool = True
+) -> pd.DataFrame:
 
-    records = []
+    # Message has this format (last column is missing from old versions):
+    # ['Received',
+    #  'Nov 11, 2012 15:34:01 PM',
+    #  'Alexandra Jovez',
+    #  '+16095552144',
+    #  "What did you end up getting?.",
+    #  "iMessage"]
 
-    for row in raw_rows:
-        # Message has this format (last row is missing from old versions):
-        # ['Received',
-        #  'Nov 11, 2012 15:34:01 PM',
-        #  'Alexandra Jovez',
-        #  '+16095552144',
-        #  "What did you end up getting?.",
-        #  "iMessage"]
+    # with `cache=True`, each distinct timestamp string is only parsed once
+    try:
+        timestamp = pd.to_datetime(
+            raw_df["timestamp"],
+            format=PHONEVIEW_EXTERNAL_TIMESTAMP_FORMAT,
+            cache=True)
+    except ValueError:
+        timestamp = _parse_timestamp_column(raw_df["timestamp"])
 
-        timestamp = datetime.datetime.strptime(row[1], "%b %d, %Y %H:%M:%S %p")
+    columns = {
+        "timestamp": timestamp,
+        "inbound": raw_df["direction"].eq(PHONEVIEW_EXTERNAL_RECEIVED),
+        "length": raw_df["content"].str.len(),
+        "content": raw_df["content"],
+    }
 
-        inbound = (row[0] == PHONEVIEW_EXTERNAL_RECEIVED)
+    if keep_name:
+        columns["name"] = raw_df["name"]
 
-        record = collections.OrderedDict({
-            "timestamp": timestamp,
-            "inbound": inbound,
-            "length": len(row[4]),
-            "content": row[4],
-            "name": row[2],
-            "number": row[3],
-            "type": row[5] if len(row) >= 5 else "",
-        })
+    if keep_number:
+        columns["number"] = raw_df["number"]
 
-        records.append(record)
+    if keep_type:
+        columns["type"] = raw_df["type"] if "type" in raw_df else ""
 
-    return records
+    return pd.DataFrame(columns, index=raw_df.index)
 
 
+@functools.lru_cache(maxsize=4096)
 def _normalize_phone_number(phone_number: typing.Union[str, int]) -> str:
     try:
         # using a dedicated package if available
@@ -155,125 +236,237 @@ def _normalize_phone_number(phone_number: typing.Union[str, int]) -> str:
             num_format=phonenumbers.PhoneNumberFormat.E164)
 
     except ImportError:
-        if phone_number is int:
+        if isinstance(phone_number, int):
             normalized_phone_number = str(phone_number)
         else:
-            normalized_phone_number = phone_number
-            for c in " ()-+":
-                normalized_phone_number = normalized_phone_number.replace(c, "")
+            normalized_phone_number = phone_number.translate(_PHONE_STRIP_TABLE)
 
     return normalized_phone_number
 
 
 # noinspection PyBroadException
-def _compare_phone_numbers(
-        *phone_numbers: typing.Union[str, int]
-) -> bool:
+def _try_normalize_phone_number(
+        phone_number: typing.Union[str, int]
+) -> typing.Optional[str]:
     try:
-        return len(set(map(_normalize_phone_number, phone_numbers))) == 1
+        return _normalize_phone_number(phone_number)
     except:
-        return False
+        return None
+
+
+def _read_csv_batches_with_pandas(
+        filepath: str,
+        has_header: bool,
+        column_names: typing.Optional[typing.List[str]] = None,
+        batch_size: int = CSV_BATCH_SIZE,
+) -> typing.Iterator[pd.DataFrame]:
+
+    # every value is read as a string, and since an empty field is just an
+    # empty string, skip the detection of missing values altogether; the C
+    # parser is requested explicitly, so that pandas raises rather than
+    # silently falling back to the much slower Python parser
+    with pd.read_csv(
+            filepath,
+            engine="c",
+            header=0 if has_header else None,
+            names=column_names,
+            dtype=str,
+            na_filter=False,
+            chunksize=batch_size) as reader:
+
+        for raw_df in reader:
+            yield raw_df
+
+
+def _read_csv_batches_with_polars(
+        filepath: str,
+        has_header: bool,
+        column_names: typing.Optional[typing.List[str]] = None,
+        batch_size: int = CSV_BATCH_SIZE,
+) -> typing.Iterator[pd.DataFrame]:
+
+    # Polars library: Only needed for this engine, may need to be installed
+    try:
+        import polars as pl
+    except ImportError as err:
+        raise ImportError(textwrap.dedent(
+            """
+            You are missing the `polars` package, which is required to load
+            files with `engine="polars"`. Install it before proceeding.
+
+            See: https://docs.pola.rs/user-guide/installation/
+            """)) from err
+
+    # every column is read as a string, as with the pandas engine
+    lazy_df = pl.scan_csv(
+        filepath,
+        has_header=has_header,
+        infer_schema=False,
+        empty_string_is_null=False)
+
+    for batch in lazy_df.collect_batches(chunk_size=batch_size):
+        raw_df = batch.to_pandas()
+
+        if column_names is not None:
+            raw_df.columns = column_names[:len(raw_df.columns)]
+
+        yield raw_df
+
+
+def _post_process_msg_df(
+        df: pd.DataFrame,
+        filter_phone_number: bool,
+        normalized_phone_number: typing.Optional[str],
+        keep_type: bool,
+        keep_other_identity: bool
+) -> pd.DataFrame:
+
+    # decide which rows and columns to keep first, so that the result is
+    # copied out of the dataframe once, rather than once per step
+    rows = slice(None)
+    columns = df.columns
+
+    # if user requested records for specific number, only keep records
+    # from that number (numbers that cannot be normalized never match)
+    if filter_phone_number and "number" in df:
+        if normalized_phone_number is None:
+            rows = np.zeros(len(df), dtype=bool)
+        else:
+            # normalize each distinct number once (the cache of
+            # `_normalize_phone_number` does not cover numbers that fail to
+            # parse), and let pandas map the results back onto every row
+            numbers = df["number"]
+            normalized_numbers = {
+                number: _try_normalize_phone_number(number)
+                for number in numbers.unique()
+            }
+            rows = numbers.map(normalized_numbers).eq(normalized_phone_number)
+
+    # if user wants name/number dropped, remove from records
+    if not keep_other_identity:
+        columns = columns.drop(["name", "number"], errors="ignore")
+
+    if not keep_type:
+        columns = columns.drop(["type"], errors="ignore")
+
+    return df.loc[rows, columns]
 
 
 def load_csv(
         filepath: str,
         phone_number: typing.Optional[str] = None,
         keep_type: bool = True,
-        keep_other_identity: bool = False
+        keep_other_identity: bool = False,
+        engine: str = "pandas"
 ) -> pd.DataFrame:
 
-    # read CSV file using standard Python library
+    # peek at the first row to find out which format the file is in
     with open(filepath, "r") as csv_file:
-        csv_reader = csv.reader(csv_file,
-                                delimiter=',',
-                                quotechar='"',
-                                quoting=csv.QUOTE_ALL)
-        raw_rows = [row for row in csv_reader]
+        first_row = next(csv.reader(csv_file), None)
 
-    if len(raw_rows) == 0:
+    if first_row is None:
         return
 
     # if the first row contains headers, and coincides with internal
     # field names, then we have a file in the internal format
-    if len(set(raw_rows[0]).intersection(set(PHONEVIEW_INTERNAL_DB_FIELDS))) > 1:
-
-        header = raw_rows[0]
-
-        records = _load_internal_phoneview_msg_file(
-            raw_rows=raw_rows[1:],
-            header=header,
-        )
+    is_internal = _is_internal_phoneview_header(first_row)
+
+    # only build the identity and type columns if they will be kept (the
+    # number is also needed to filter by phone number, if requested)
+    keep_number = keep_other_identity or phone_number is not None
+
+    if is_internal:
+        load_msg_file = functools.partial(
+            _load_internal_phoneview_msg_file,
+            keep_number=keep_number,
+            keep_name=keep_other_identity)
+        column_names = None
+    else:
+        load_msg_file = functools.partial(
+            _load_external_phoneview_msg_file,
+            keep_number=keep_number,
+            keep_name=keep_other_identity,
+            keep_type=keep_type)
+        column_names = PHONEVIEW_EXTERNAL_FIELDS
+
+    # the file is streamed in batches, so that only one batch of raw rows
+    # is in memory at a time
+    if engine == "pandas":
+        raw_dfs = _read_csv_batches_with_pandas(
+            filepath,
+            has_header=is_internal,
+            column_names=column_names)
+
+    elif engine == "polars":
+        raw_dfs = _read_csv_batches_with_polars(
+            filepath,
+            has_header=is_internal,
+            column_names=column_names)
 
     else:
-        records = _load_external_phoneview_msg_file(
-            raw_rows=raw_rows
+        raise ValueError("{} is not a valid value for `engine`".format(
+            engine,
+        ))
+
+    # normalize the requested number once, rather than once per record
+    normalized_phone_number = None
+    if phone_number is not None:
+        normalized_phone_number = _try_normalize_phone_number(phone_number)
+
+    # post process each batch as it is loaded, so that the records that are
+    # filtered out do not pile up in memory
+    dfs = [
+        _post_process_msg_df(
+            df=load_msg_file(raw_df=raw_df),
+            filter_phone_number=phone_number is not None,
+            normalized_phone_number=normalized_phone_number,
+            keep_type=keep_type,
+            keep_other_identity=keep_other_identity,
         )
+        for raw_df in raw_dfs
+    ]
+    dfs = [df for df in dfs if len(df) > 0]
 
-    # post process
-    post_processed_records = []
-
-    for record in records:
-
-        # if user requested records for specific number, skip record if not
-        # from that number
-        if phone_number is not None and "number" in record:
-            if not _compare_phone_numbers(record["number"], phone_number):
-                continue
-
-        # if user wants name/number dropped, remove from record
-        if not keep_other_identity:
-            if "name" in record:
-                del record["name"]
-            if "number" in record:
-                del record["number"]
-
-        if not keep_type and "type" in record:
-            del record["type"]
-
-        post_processed_records.append(record)
-
-    if len(post_processed_records) == 0:
+    if len(dfs) == 0:
         return
 
-    # sort chronologically by timestamp
-    post_processed_records = sorted(
-        post_processed_records,
-        key=lambda record: record["timestamp"]
-    )
+    df = pd.concat(dfs) if len(dfs) > 1 else dfs[0]
 
-    # create the pandas dataframe, index by timestamp and sort chronologically
-    df = pd.DataFrame(post_processed_records)
+    # index by timestamp and sort chronologically, unless the file already
+    # was (as exports usually are); the sort is stable, so that messages
+    # sharing a timestamp stay in file order
     df = df.set_index("timestamp")
-    df = df.sort_index(ascending=True)
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index(ascending=True, kind="stable")
 
     return df
 
 
-def erase_labels(lst, regexp=r"([0-9]*)/[0-9]*"):
+def erase_labels(lst, regexp=DEFAULT_LABEL_REGEXP):
 
     # default regexp, saves first number
-    if regexp is None:
-        regexp = r"([0-9]*)/[0-9]*"
+    if regexp is None or regexp == DEFAULT_LABEL_REGEXP:
+        cregexp = _DEFAULT_LABEL_RE
 
-    cregexp = re.compile(regexp)
-
-    new_lst = []
-    prev_new_item = None
+    else:
+        cregexp = _LABEL_RE_CACHE.get(regexp)
+        if cregexp is None:
+            cregexp = re.compile(regexp)
+            _LABEL_RE_CACHE[regexp] = cregexp
 
-    for item in lst:
-        new_item = ""
+    # without capture groups, nothing is saved from any label
+    if cregexp.groups == 0:
+        return [""] * len(lst)
 
-        m = cregexp.search(item)
-        if m is not None:
-            new_item = "".join(m.groups())
-            if new_item == prev_new_item:
-                new_item = ""
-            else:
-                prev_new_item = new_item
+    # join the groups captured in each label, or NaN if the label does not
+    # match at all
+    groups = pd.Series(lst, dtype=object).str.extract(cregexp, expand=True)
+    new_items = groups.fillna("").sum(axis=1).where(groups.notna().any(axis=1))
 
-        new_lst.append(new_item)
+    # erase a label when it repeats the last label that matched
+    repeated = new_items.eq(new_items.ffill().shift())
 
-    return new_lst
+    return new_items.mask(repeated, "").fillna("").tolist()
 
 
 def dump_to_csv(dataframe: pd.DataFrame, filepath: str = None) -> typing.Optional[str]:
@@ -281,47 +474,34 @@ def dump_to_csv(dataframe: pd.DataFrame, filepath: str = None) -> typing.Optiona
     if dataframe.index.name is not None:
         dataframe = dataframe.reset_index()
 
-    header = dataframe.columns.to_list()
-
-    record_list = list()
-
-    for row_id, row in enumerate(dataframe.values.tolist()):
-        row_dict = dict(zip(header, row))
-
-        record = collections.OrderedDict({
-            "id": row_id,
-            "date": int(row_dict["timestamp"].to_pydatetime().timestamp()),
-            "address": row_dict.get("number", ""),
-            "text": row_dict.get("content", ""),
-            "flags": (
-                PHONEVIEW_INTERNAL_RECEIVED if row_dict["inbound"]
-                else PHONEVIEW_INTERNAL_SENT),
-        })
-
-        record_list.append(record)
-
-    if filepath is not None:
-        f = open(filepath, "w", newline="")
-
-    else:
-        f = io.StringIO(newline="")
-
-    field_names = list(record_list[0].keys())
-    writer = csv.DictWriter(
-        f,
-        fieldnames=field_names,
-        delimiter=',',
+    # the timestamps are naive local times, convert them back to Unix format
+    # with `datetime.timestamp`, once per distinct value (pandas has no
+    # vectorized path for the local timezone)
+    timestamp = pd.to_datetime(dataframe["timestamp"])
+    unix_timestamps = {
+        value: int(value.to_pydatetime().timestamp())
+        for value in timestamp.unique()
+    }
+    unix_timestamp = timestamp.map(unix_timestamps)
+
+    output_df = pd.DataFrame({
+        "id": range(len(dataframe)),
+        "date": unix_timestamp,
+        "address": dataframe["number"] if "number" in dataframe else "",
+        "text": dataframe["content"] if "content" in dataframe else "",
+        "flags": np.where(
+            dataframe["inbound"],
+            PHONEVIEW_INTERNAL_RECEIVED,
+            PHONEVIEW_INTERNAL_SENT),
+    })
+
+    # returns the CSV as a string if no filepath is provided
+    return output_df.to_csv(
+        filepath,
+        index=False,
         quotechar='"',
-        quoting=csv.QUOTE_ALL)
-
-    writer.writeheader()
-    writer.writerows(record_list)
-
-    if filepath is not None:
-        return
-
-    else:
-        return f.getvalue()
+        quoting=csv.QUOTE_ALL,
+        lineterminator="\r\n")
 
 
 def plot_texts(
@@ -339,44 +519,35 @@ def plot_texts(
 
     df = texts_df
 
-    def aggregate_df(df):
-        if count_or_volume == PlotStyle.COUNT:
-            agg_df = df.resample(time_frequency).count().drop(columns=["length", "content"])
-        elif count_or_volume == PlotStyle.VOLUME:
-            agg_df = df.resample(time_frequency).sum().drop(columns=["inbound"])
-        else:
-            raise ValueError("{} is not a valid value for `count_or_volume`".format(
-                count_or_volume,
-            ))
-
-        column_name = agg_df.columns.to_list()[0]
-
-        if remove_gaps:
-            agg_df = agg_df[agg_df[column_name] > 0]
-
-        return agg_df
-
+    # only aggregate the column that is plotted
+    if count_or_volume == PlotStyle.COUNT:
+        column_name, how = "inbound", "count"
+    elif count_or_volume == PlotStyle.VOLUME:
+        column_name, how = "length", "sum"
+    else:
+        raise ValueError("{} is not a valid value for `count_or_volume`".format(
+            count_or_volume,
+        ))
 
     if split_by_direction:
 
-        # split by inbound/outbound
-        df_inbound = df[df["inbound"] == True]
-        df_outbound = df[df["inbound"] == False]
-
-        # stack the two datasets
-        processed_df = pd.merge(
-            aggregate_df(df_inbound),
-            aggregate_df(df_outbound),
-            how="outer",
-            on=["timestamp"]
+        # resample inbound/outbound messages separately, in a single grouped
+        # operation, and put the two directions side by side
+        processed_df = (
+            df.groupby("inbound")[column_name]
+            .resample(time_frequency)
+            .agg(how)
+            .unstack("inbound")
+            .reindex(columns=[True, False])
+            .rename(columns={True: "received", False: "sent"})
+            .rename_axis(columns=None)
         )
 
-        # rename columns
-        processed_df.rename(columns={"inbound_x": "received", "inbound_y": "sent"}, inplace=True)
-        processed_df.rename(columns={"length_x": "received", "length_y": "sent"}, inplace=True)
-
     else:
-        processed_df = aggregate_df(df)
+        processed_df = df[[column_name]].resample(time_frequency).agg(how)
+
+    if remove_gaps:
+        processed_df = processed_df[processed_df > 0].dropna(how="all")
 
     if rescaled:
         processed_df = processed_df.div(processed_df.sum(1), axis=0)